@@ -0,0 +1 @@
+\[\033[1;97;44m\] \u \[\033[0;34;104m\]\[\033[1;97;104m\] \h \[\033[0;94;107m\]\[\033[1;90;107m\] $(pt_bash_prompt_command) \[\033[0;97;49m\]\[\033[1;38;5;74;49m\] 
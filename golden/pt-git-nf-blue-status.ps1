@@ -0,0 +1 @@
+\[\033[38;5;15;48;5;18m\] \u\[\033[38;5;18;48;5;21m\]\[\033[38;5;15;48;5;21m\] \h\[\033[38;5;21;48;5;33m\]${pt_git_inside:+\[\033[38;5;15;48;5;33m\]" "}${pt_git_branch:+""${pt_git_branch}}${pt_git_ahead:+" ⇡"${pt_git_ahead}}${pt_git_behind:+" ⇣"${pt_git_behind}}${pt_git_conflicts:+"  "${pt_git_conflicts}}${pt_git_staged:+" +"${pt_git_staged}}${pt_git_unstaged:+" !"${pt_git_unstaged}}${pt_git_untracked:+" ?"${pt_git_untracked}}${pt_git_stash:+"  "${pt_git_stash}}${pt_git_clean:+" "}\[\033[38;5;33;48;5;15m\]\[\033[38;5;18;48;5;15m\] $(pt_bash_prompt_command 40 '')\[\033[97;49m\]\[\033[0m\] 
@@ -0,0 +1 @@
+\[\033[38;5;15;48;5;18m\] \u\[\033[38;5;18;48;5;21m\]\[\033[38;5;15;48;5;21m\] \h\[\033[38;5;21;48;5;33m\]\[\033[38;5;15;48;5;33m\]$([ $(pt_get_git_dir) == 1 ] && echo -n $'' && echo -n ' ')$([ $(pt_get_git_dir) == 1 ] && echo -n $(pt_get_git_branch) && echo -n ' ')$([ $(pt_get_git_dir) == 1 ] && echo -n $(pt_get_git_clean $'' $'פֿ'))\[\033[38;5;33;48;5;15m\]\[\033[38;5;18;48;5;15m\] $(pt_bash_prompt_command 40 $'')\[\033[97;49m\]\[\033[0m\] 
@@ -0,0 +1 @@
+\[\033[1;38;5;197;48;5;22m\] \u\[\033[0;38;5;22;48;5;34m\]\[\033[38;5;0;48;5;34m\] \h\[\033[38;5;34;48;5;41m\]\[\033[38;5;0;48;5;41m\]$([ $(pt_get_git_dir) == 1 ] && echo -n $'' && echo -n ' ')$([ $(pt_get_git_dir) == 1 ] && echo -n $(pt_get_git_branch) && echo -n ' ')$([ $(pt_get_git_dir) == 1 ] && echo -n $(pt_get_git_clean $'' $'פֿ'))\[\033[38;5;41;48;5;15m\]\[\033[38;5;22;48;5;15m\] $(pt_bash_prompt_command 40 $'')\[\033[97;49m\]\[\033[0m\] 
@@ -0,0 +1 @@
+\[\033[38;5;15;48;5;52m\] \u\[\033[38;5;52;48;5;160m\]\[\033[38;5;15;48;5;160m\] \h\[\033[38;5;160;48;5;175m\]\[\033[38;5;0;48;5;175m\]$([ $(pt_get_git_dir) == 1 ] && echo -n $'' && echo -n ' ')$([ $(pt_get_git_dir) == 1 ] && echo -n $(pt_get_git_branch) && echo -n ' ')$([ $(pt_get_git_dir) == 1 ] && echo -n $(pt_get_git_clean $'' $'פֿ'))\[\033[38;5;175;48;5;15m\]\[\033[38;5;52;48;5;15m\] $(pt_bash_prompt_command 40 $'')\[\033[97;49m\]\[\033[0m\] 
@@ -0,0 +1 @@
+${debian_chroot:+($debian_chroot)}\[\033[1;31m\]\h \[\033[1;34m\]\w #\[\033[0m\] 
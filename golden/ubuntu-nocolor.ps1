@@ -0,0 +1 @@
+${debian_chroot:+($debian_chroot)}\u@\h \w $ 
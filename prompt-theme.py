@@ -39,6 +39,24 @@ import argparse
 import json
 import copy
 import os
+import time
+import struct
+import ctypes
+import ctypes.util
+import mmap
+import zlib
+import html
+import subprocess
+import concurrent.futures
+import signal
+import colorsys
+import random
+import tempfile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 ############
 # General
@@ -58,9 +76,40 @@ def main(argv: list):
     """
 
     options = processOptions(argv)
+    if options['watch'] != None:
+        watchThemes(options['watch'], options['cacheDir'])
+        sys.exit(0)
+    if options['preview'] != None:
+        previewThemes(options['previewFiles'], options['preview'], options['output'])
+        sys.exit(0)
+    if options['exportBundle'] != None:
+        writeThemeBundle(options['exportBundle'], options['bundle'])
+        sys.exit(0)
+    if options['bundle'] != None:
+        fragments = getBundleFragments(openThemeBundle(options['bundle']), options['themeName'])
+        if fragments == None:
+            errorExit('Could not find theme in bundle')
+        printPrompt(''.join(fragments))
+        sys.exit(0)
+    if options['serve']:
+        serveTheme(validateTheme(options['theme']))
+        sys.exit(0)
+    if options['generate'] != None:
+        for themefile in generateThemes(options['generate'], options['gradient'], options['outputDir']):
+            print(themefile)
+        sys.exit(0)
+    if options['golden'] != None:
+        ok = checkGolden(options['themeDir'], options['golden'], options['writeGolden'],
+            options['fuzz'] or FUZZ_GOLDEN_COUNT, options['seed'])
+        sys.exit(0 if ok else 1)
+    if options['fuzz'] != None:
+        sys.exit(0 if fuzzCompiler(options['fuzz'], options['seed']) else 1)
+    if options['profile']:
+        printProfileReport(readProfileLog(options['profileLog'], options['last']))
+        sys.exit(0)
     theme = options['theme']
     theme = validateTheme(theme)
-    promptStr = getPromptStr(theme)
+    promptStr = getPromptStr(theme, options['instrument'])
     printPrompt(promptStr)
     sys.exit(0)
 
@@ -75,7 +124,7 @@ def processOptions(argv: list)->dict:
     Returns
     -------
     dictionary
-        The JSON theme
+        The JSON theme and the mode-specific options
     """
 
     parser = argparse.ArgumentParser(
@@ -85,12 +134,201 @@ def processOptions(argv: list)->dict:
         '--theme',
         '-t',
         type=str,
-        required=True,
         help="The theme in JSON format"
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        '--watch',
+        '-w',
+        type=str,
+        help="Watch a theme directory and publish compiled prompts to the cache on change"
+    )
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=getCacheDir(),
+        help="The directory compiled prompts are published to"
+    )
+    parser.add_argument(
+        '--export-bundle',
+        type=str,
+        help="Compile every theme in a directory into the theme bundle"
+    )
+    parser.add_argument(
+        '--bundle',
+        '-b',
+        type=str,
+        help="The theme bundle file. With --theme, the theme is looked up by name in the bundle"
+    )
+    parser.add_argument(
+        '--preview',
+        '-p',
+        type=str,
+        choices=['ansi', 'html'],
+        help="Render a preview of the theme, or of every theme with --gallery"
+    )
+    parser.add_argument(
+        '--gallery',
+        type=str,
+        help="Render previews of every theme in a directory"
+    )
+    parser.add_argument(
+        '--output',
+        '-o',
+        type=str,
+        help="The file previews are written to. Defaults to stdout"
+    )
+    parser.add_argument(
+        '--instrument',
+        action='store_true',
+        help="Add per-segment timing marks to the prompt (see pt_prof_flush)"
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help="Print per-segment timing histograms from the profile log"
+    )
+    parser.add_argument(
+        '--profile-log',
+        type=str,
+        help="The profile log, or a directory of them. Defaults to the profile directory in the cache directory"
+    )
+    parser.add_argument(
+        '--last',
+        type=int,
+        default=100,
+        help="The number of prompts of each profile log the report covers"
+    )
+    parser.add_argument(
+        '--serve',
+        action='store_true',
+        help="Serve prompt renders for the theme over stdin/stdout (see pt_serve_start)"
+    )
+    parser.add_argument(
+        '--generate',
+        type=str,
+        nargs='+',
+        help="Generate a theme for each base color"
+    )
+    parser.add_argument(
+        '--gradient',
+        type=str,
+        help="With --generate, use a gradient from each base color to this color"
+    )
+    parser.add_argument(
+        '--output-dir',
+        type=str,
+        default='.',
+        help="The directory generated themes are written to"
+    )
+    parser.add_argument(
+        '--golden',
+        type=str,
+        help="Compare every theme's compiled prompt with the golden corpus in this directory"
+    )
+    parser.add_argument(
+        '--write-golden',
+        action='store_true',
+        help="With --golden, write the corpus instead of comparing (--fuzz sets the number of random themes)"
+    )
+    parser.add_argument(
+        '--theme-dir',
+        type=str,
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompt-themes'),
+        help="The theme directory used with --golden"
+    )
+    parser.add_argument(
+        '--fuzz',
+        type=int,
+        help="Compile this many random themes and compare the fast paths with the reference"
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help="The random seed used with --fuzz"
+    )
+    args = parser.parse_args(argv)
+
+    options={
+        "theme": None,
+        "themeName": args.theme,
+        "watch": None,
+        "exportBundle": None,
+        "bundle": args.bundle,
+        "preview": None,
+        "previewFiles": None,
+        "output": args.output,
+        "instrument": args.instrument,
+        "profile": args.profile,
+        "serve": args.serve,
+        "generate": args.generate,
+        "gradient": args.gradient,
+        "outputDir": args.output_dir,
+        "golden": args.golden,
+        "writeGolden": args.write_golden,
+        "themeDir": args.theme_dir,
+        "fuzz": args.fuzz,
+        "seed": args.seed,
+        "profileLog": args.profile_log or os.path.join(args.cache_dir, 'profile'),
+        "last": args.last,
+        "cacheDir": args.cache_dir
+    }
+
+    if args.profile or args.generate != None or args.golden != None or args.fuzz != None:
+        return options
+
+    if args.watch != None:
+        if not os.path.isdir(args.watch):
+            errorExit('Could not find theme directory')
+        options['watch'] = args.watch
+        return options
+
+    if args.gallery != None:
+        if not os.path.isdir(args.gallery):
+            errorExit('Could not find theme directory')
+        options['preview'] = args.preview or 'html'
+        options['previewFiles'] = [os.path.join(args.gallery, n + '.json')
+            for n in sorted(getThemeNames(args.gallery))]
+        return options
+
+    if args.preview != None:
+        if args.theme == None or not os.path.isfile(args.theme):
+            errorExit('Could not find theme file')
+        options['preview'] = args.preview
+        options['previewFiles'] = [args.theme]
+        return options
+
+    if args.export_bundle != None:
+        if not os.path.isdir(args.export_bundle):
+            errorExit('Could not find theme directory')
+        options['exportBundle'] = args.export_bundle
+        if options['bundle'] == None:
+            options['bundle'] = os.path.join(args.cache_dir, 'themes.ptb')
+            os.makedirs(args.cache_dir, exist_ok=True)
+        return options
+
+    if args.theme == None:
+        errorExit('One of --theme, --watch, --gallery or --export-bundle is required')
+
+    if args.bundle != None:
+        return options
+
+    options['theme'] = loadThemeFile(args.theme)
+    return options
+
+def loadThemeFile(themefile: str) -> list:
+    """Load a theme file in JSON format
 
-    themefile = args.theme
+    Parameters
+    ----------
+    themefile : str
+        The path to the theme file
+
+    Returns
+    -------
+    list
+        The JSON theme
+    """
 
     if not os.path.isfile(themefile):
         errorExit('Could not find theme file')
@@ -107,10 +345,7 @@ def processOptions(argv: list)->dict:
 
     if theme == None:
         sys.exit(1)
-    options={
-        "theme": theme
-    }
-    return options
+    return theme
 
 def errorExit(message: str):
     """Print the given error message and exit the script with an error code
@@ -184,9 +419,26 @@ def validateComponent(component: dict) -> dict:
     if (nComponent['type'].lower() != 'text'
         and nComponent['type'].lower() != 'env'
         and nComponent['type'].lower() != 'reset'
+        and nComponent['type'].lower() != 'git'
+        and nComponent['type'].lower() != 'cwd'
+        and nComponent['type'].lower() not in CONTEXT_TYPES
         ):
         errorExit('Invalid type: ' + nComponent['type'])
 
+    if nComponent['type'].lower() == 'aws':
+        if 'region' not in nComponent:
+            nComponent['region'] = False
+
+    if nComponent['type'].lower() == 'cwd':
+        if 'maxlen' not in nComponent:
+            nComponent['maxlen'] = 25
+        if 'trunc' not in nComponent:
+            nComponent['trunc'] = '..'
+
+    if nComponent['type'].lower() == 'git':
+        if 'field' not in nComponent or nComponent['field'] not in GIT_FIELDS:
+            errorExit('Invalid git field: %s' % (nComponent.get('field')))
+
     if 'color' not in nComponent:
         nComponent['color'] = None
 
@@ -234,7 +486,7 @@ def validateColor(color: str) -> bool:
     #        errorExit('Color outside expected range of 0 to 255 (%s)' % color)
     #todo: names
 
-def getPromptStr(theme: list) -> str:
+def getPromptStr(theme: list, instrument: bool=False) -> str:
     """Get a prompt string from the theme
 
     Parameters
@@ -242,6 +494,9 @@ def getPromptStr(theme: list) -> str:
     theme : list
         The theme components
 
+    instrument : bool
+        Record the time each component takes to expand (see pt_prof_flush)
+
     Returns
     -------
     str
@@ -249,10 +504,14 @@ def getPromptStr(theme: list) -> str:
     """
 
     promptStr=''
-    for component in theme:
+    if instrument:
+        promptStr+=getProfileMark(0)
+    for iC,component in enumerate(theme):
         text=getComponentStr(component)
         if text!=None:
             promptStr+=text
+        if instrument:
+            promptStr+=getProfileMark(iC+1)
 
     return promptStr
 
@@ -278,12 +537,143 @@ def getComponentStr(component: dict) -> str:
         hasColor = False
     elif type == 'env':
         text = os.environ[component['env']]
+    elif type == 'git':
+        return getGitFieldStr(component)
+    elif type == 'aws' and component['region']:
+        return getConditionalStr('pt_ctx_aws_region', component, True)
+    elif type in CONTEXT_TYPES:
+        return getConditionalStr('pt_ctx_%s' % (type), component, True)
+    elif type == 'cwd':
+        text = (text or '') + '$(pt_bash_prompt_command %d %s)' % (
+            int(component['maxlen']), getShellQuoted(component['trunc']))
 
     if text != None and hasColor:
         text = formatColor(component['color'])+text
 
     return text
 
+def getGitFieldStr(component: dict) -> str:
+    """Get a prompt string for a git status field
+
+    Parameters
+    ----------
+    component : dict
+        The git theme component
+
+    Returns
+    -------
+    str
+        The prompt string
+
+    Notes
+    -----
+    The fields are shell variables set by pt_git_status. The color and text
+    are only shown when the field is set, followed by the field's value for
+    fields that have one.
+    """
+
+    field = component['field']
+    return getConditionalStr('pt_git_%s' % (field), component, GIT_FIELDS[field])
+
+def getConditionalStr(variable: str, component: dict, showValue: bool) -> str:
+    """Get a prompt string that is only shown when a shell variable is set
+
+    Parameters
+    ----------
+    variable : str
+        The shell variable name (or array element)
+
+    component : dict
+        The theme component, whose color and text are shown
+
+    showValue : bool
+        Show the variable's value after the text
+
+    Returns
+    -------
+    str
+        The prompt string
+    """
+
+    text = component['text'] if component['text'] != None else ''
+    text = '"%s"' % (getPromptQuoted(text))
+    if showValue:
+        text += '${%s}' % (variable)
+    if component['color'] != None:
+        text = formatColor(component['color'])+text
+    return '${%s:+%s}' % (variable, text)
+
+def getPromptQuoted(text: str) -> str:
+    """Quote prompt text for use between double quotes inside ${var:+...}
+
+    Parameters
+    ----------
+    text : str
+        The section text, as it would be written in a text section
+
+    Returns
+    -------
+    str
+        The text, rendering the same as in a text section
+
+    Notes
+    -----
+    Bash first decodes the prompt escapes (\\u, \\\\, ...), then expands the
+    result as if it were double quoted, except that inside ${var:+...} a
+    backslash also quotes ' and }, and a bare " or ` ends the word. So the
+    text is decoded the same way and every literal ", `, \\ and escaped $ is
+    quoted for the inner double quotes. $(...) and $var still expand.
+    """
+
+    decoded = []
+    iC = 0
+    while iC < len(text):
+        if text[iC] == '\\' and text[iC + 1:iC + 2] == '\\':
+            decoded.append((False, '\\'))
+            iC += 2
+        elif text[iC] == '\\' and text[iC + 1:iC + 2] != '' and text[iC + 1] in PROMPT_ESCAPES:
+            decoded.append((True, text[iC:iC + 2]))
+            iC += 2
+        else:
+            decoded.append((False, text[iC]))
+            iC += 1
+
+    quoted = ''
+    iD = 0
+    while iD < len(decoded):
+        isEscape, value = decoded[iD]
+        nextValue = decoded[iD + 1] if iD + 1 < len(decoded) else (True, '')
+        if isEscape:
+            quoted += value
+        elif value == '\\' and not nextValue[0] and nextValue[1] in PROMPT_QUOTED:
+            # A decoded backslash quotes these in a text section too
+            quoted += PROMPT_QUOTED[nextValue[1]]
+            iD += 1
+        elif value == '\\':
+            quoted += PROMPT_QUOTED['\\']
+        elif value == '"' or value == '`':
+            quoted += '\\' + value
+        else:
+            quoted += value
+        iD += 1
+    return quoted
+
+def getShellQuoted(text: str) -> str:
+    """Quote text as a single shell word
+
+    Parameters
+    ----------
+    text : str
+        The text
+
+    Returns
+    -------
+    str
+        The single-quoted text
+    """
+
+    return "'%s'" % (text.replace("'", "'\\''"))
+
 ############
 # Color
 ############
@@ -796,7 +1186,10 @@ def getColor8BitLookupDict() -> dict:
     nameMap = {}
     rgbMap = {}
     hexMap = {}
+    idMap = {}
     groups = []
+    for color in searchColors + greyColors:
+        idMap[color['colorId']] = (color['rgb']['r'], color['rgb']['g'], color['rgb']['b'])
     for color in searchColors:
         if color['rgb']['r'] not in groups:
             groups.append(color['rgb']['r'])
@@ -847,7 +1240,8 @@ def getColor8BitLookupDict() -> dict:
         'bestRgb': bestRgb,
         'bestHex': bestHex,
         'bestGreyRgb': bestGreyRgb,
-        'bestGreyHex': bestGreyHex
+        'bestGreyHex': bestGreyHex,
+        'idMap': idMap
     }
 
 
@@ -890,6 +1284,313 @@ def getColor4BitLookupDict() -> dict:
     }
 
 
+############
+# Palette
+############
+def getColorConversionTable() -> dict:
+    """Return the tables used to convert rgb arrays to color codes
+
+    Returns
+    -------
+    dict
+        The conversion tables, built on first use
+
+    Notes
+    -----
+    The 8-bit tables reproduce getBestColorFromRgbDepth: each channel is
+    snapped to the nearest palette level, greys to the nearest grey. Level
+    combinations that have no palette entry (where getBestColorFromRgbDepth
+    has no answer) use the nearest palette color instead.
+    """
+
+    global COLOR_CONVERSION_T
+    if COLOR_CONVERSION_T != None:
+        return COLOR_CONVERSION_T
+
+    idMap = COLOR_8BIT_D['idMap']
+    levels = sorted(set(COLOR_8BIT_D['bestRgb'].values()))
+    levelIndex = [levels.index(COLOR_8BIT_D['bestRgb'][i]) for i in range(256)]
+    cube = []
+    for r in levels:
+        for g in levels:
+            for b in levels:
+                rgb = 'rgb(%s,%s,%s)' % (r, g, b)
+                if rgb in COLOR_8BIT_D['rgbMap']:
+                    cube.append(COLOR_8BIT_D['rgbMap'][rgb])
+                else:
+                    cube.append(getNearestColorId((r, g, b), range(256)))
+    grey = []
+    for i in range(256):
+        level = COLOR_8BIT_D['bestGreyRgb'][i]
+        grey.append(COLOR_8BIT_D['rgbMap']['rgb(%s,%s,%s)' % (level, level, level)])
+    basic = [getNearestColorId(idMap[iC], range(16)) for iC in range(256)]
+
+    COLOR_CONVERSION_T = {
+        'levelCount': len(levels),
+        'levelIndex': levelIndex,
+        'cube': cube,
+        'grey': grey,
+        'basic': basic
+    }
+    if numpy != None:
+        COLOR_CONVERSION_T['numpy'] = {
+            'levelIndex': numpy.asarray(levelIndex, dtype=numpy.intp),
+            'cube': numpy.asarray(cube, dtype=numpy.intp),
+            'grey': numpy.asarray(grey, dtype=numpy.intp),
+            'basic': numpy.asarray(basic, dtype=numpy.intp)
+        }
+    return COLOR_CONVERSION_T
+
+def getNearestColorId(rgb: tuple, colorIds) -> int:
+    """Return the 8-bit color id nearest to an rgb value
+
+    Parameters
+    ----------
+    rgb : tuple
+        The (r, g, b) value
+
+    colorIds : iterable
+        The color ids to choose from
+
+    Returns
+    -------
+    int
+        The nearest color id by squared rgb distance
+    """
+
+    idMap = COLOR_8BIT_D['idMap']
+    return min(colorIds, key=lambda iC: sum((idMap[iC][i] - rgb[i]) ** 2 for i in range(3)))
+
+def getColorCodesFromRgb(rgbs: list, depth: int) -> list:
+    """Convert a list of rgb values to color codes in one pass
+
+    Parameters
+    ----------
+    rgbs : list
+        The (r, g, b) values, or an n x 3 NumPy integer array
+
+    depth : int
+        The color bit depth (4 or 8)
+
+    Returns
+    -------
+    list
+        The color codes, as used in theme files. A NumPy array when given one
+    """
+
+    table = getColorConversionTable()
+    levelCount = table['levelCount']
+    if numpy != None and isinstance(rgbs, numpy.ndarray):
+        rgbA = rgbs.reshape(-1, 3)
+        r = rgbA[:, 0]
+        g = rgbA[:, 1]
+        b = rgbA[:, 2]
+        arrays = table['numpy']
+        levelIndex = arrays['levelIndex']
+        codes = arrays['cube'][
+            levelIndex[r] * (levelCount * levelCount) + levelIndex[g] * levelCount + levelIndex[b]]
+        isGrey = numpy.flatnonzero((r == g) & (g == b))
+        codes[isGrey] = arrays['grey'][r[isGrey]]
+        if depth != 8:
+            codes = arrays['basic'][codes]
+            codes = numpy.where(codes < 8, codes, codes + 52)
+        return codes
+
+    levelIndex = table['levelIndex']
+    cube = table['cube']
+    grey = table['grey']
+    codes = []
+    for r, g, b in rgbs:
+        if r == g and g == b:
+            codes.append(grey[r])
+        else:
+            codes.append(cube[(levelIndex[r] * levelCount + levelIndex[g]) * levelCount + levelIndex[b]])
+    if depth != 8:
+        basic = table['basic']
+        codes = [basic[code] if basic[code] < 8 else basic[code] + 52 for code in codes]
+    return codes
+
+def getRgbFromColor(color: str) -> tuple:
+    """Return the rgb value of a theme color
+
+    Parameters
+    ----------
+    color : str
+        The color as #hex, rgb(r,g,b), an 8-bit code or an 8-bit name
+
+    Returns
+    -------
+    tuple
+        The (r, g, b) value
+    """
+
+    colorRaw = color.lower().replace(' ', '')
+    if len(colorRaw) == 7 and colorRaw[:1] == '#':
+        return (int(colorRaw[1:3], 16), int(colorRaw[3:5], 16), int(colorRaw[5:7], 16))
+    elif colorRaw[:3] == 'rgb':
+        return tuple(int(c) for c in colorRaw[4:-1].split(','))
+    elif colorRaw.isdigit():
+        return COLOR_8BIT_D['idMap'][int(colorRaw)]
+    elif colorRaw in COLOR_8BIT_D['nameMap'] and colorRaw != 'default':
+        return COLOR_8BIT_D['idMap'][COLOR_8BIT_D['nameMap'][colorRaw]]
+    errorExit('Unrecognized color: %s' % (color))
+
+def getPalette(base: str, count: int) -> list:
+    """Return colors of the base color's hue from dark to light
+
+    Parameters
+    ----------
+    base : str
+        The base color
+
+    count : int
+        The number of colors
+
+    Returns
+    -------
+    list
+        The (r, g, b) values
+    """
+
+    h, l, s = colorsys.rgb_to_hls(*[c / 255 for c in getRgbFromColor(base)])
+    low = max(0.1, l - 0.25)
+    high = min(0.9, l + 0.25)
+    palette = []
+    for i in range(count):
+        li = low if count == 1 else low + (high - low) * i / (count - 1)
+        palette.append(tuple(int(round(c * 255)) for c in colorsys.hls_to_rgb(h, li, s)))
+    return palette
+
+def getGradient(start: str, end: str, count: int) -> list:
+    """Return colors evenly spaced between two colors
+
+    Parameters
+    ----------
+    start : str
+        The first color
+
+    end : str
+        The last color
+
+    count : int
+        The number of colors
+
+    Returns
+    -------
+    list
+        The (r, g, b) values
+    """
+
+    startRgb = getRgbFromColor(start)
+    endRgb = getRgbFromColor(end)
+    gradient = []
+    for i in range(count):
+        t = 0 if count == 1 else i / (count - 1)
+        gradient.append(tuple(int(round(startRgb[c] + (endRgb[c] - startRgb[c]) * t)) for c in range(3)))
+    return gradient
+
+def getTextRgb(rgb: tuple) -> tuple:
+    """Return black or white, whichever reads better on a background
+
+    Parameters
+    ----------
+    rgb : tuple
+        The background (r, g, b) value
+
+    Returns
+    -------
+    tuple
+        The text (r, g, b) value
+    """
+
+    luminance = (0.299 * rgb[0] + 0.587 * rgb[1] + 0.114 * rgb[2]) / 255
+    return (0, 0, 0) if luminance > 0.6 else (255, 255, 255)
+
+def getPaletteTheme(bgCodes: list, fgCodes: list) -> list:
+    """Return a theme with one powerline segment per background color
+
+    Parameters
+    ----------
+    bgCodes : list
+        The 8-bit segment background codes
+
+    fgCodes : list
+        The 8-bit segment text codes
+
+    Returns
+    -------
+    list
+        The theme components, in the layout of the pt-git-nf themes
+    """
+
+    theme = []
+    for iS, bg in enumerate(bgCodes):
+        segment = PALETTE_SEGMENTS[iS % len(PALETTE_SEGMENTS)]
+        if iS > 0:
+            theme.append({
+                "color": {"fg": str(bgCodes[iS - 1]), "bg": str(bg), "depth": 8},
+                "text": "\uE0B0"
+            })
+        for iC, component in enumerate(segment):
+            component = copy.deepcopy(component)
+            if iC == 0:
+                component['color'] = {"fg": str(fgCodes[iS]), "bg": str(bg), "depth": 8}
+            theme.append(component)
+    theme.append({"color": {"fg": str(bgCodes[-1]), "bg": "default", "depth": 8}, "text": "\uE0B0"})
+    theme.append({"type": "reset"})
+    theme.append({"text": " "})
+    return theme
+
+def generateThemes(bases: list, end: str, outputDir: str) -> list:
+    """Generate a palette theme for each base color and write it out
+
+    Parameters
+    ----------
+    bases : list
+        The base colors
+
+    end : str
+        The gradient end color, or None for a palette of each base's hue
+
+    outputDir : str
+        The directory the themes are written to
+
+    Returns
+    -------
+    list
+        The theme files written
+
+    Notes
+    -----
+    The colors of every theme are converted to 8-bit codes in one pass
+    """
+
+    count = len(PALETTE_SEGMENTS)
+    rgbs = []
+    for base in bases:
+        if end == None:
+            palette = getPalette(base, count)
+        else:
+            palette = getGradient(base, end, count)
+        rgbs.extend(palette)
+        rgbs.extend(getTextRgb(rgb) for rgb in palette)
+    codes = getColorCodesFromRgb(rgbs, 8)
+
+    os.makedirs(outputDir, exist_ok=True)
+    themefiles = []
+    for iB, base in enumerate(bases):
+        themeCodes = codes[iB * 2 * count:(iB + 1) * 2 * count]
+        theme = getPaletteTheme(themeCodes[:count], themeCodes[count:])
+        name = 'pt-gen-%02x%02x%02x' % getRgbFromColor(base)
+        if end != None:
+            name += '-%02x%02x%02x' % getRgbFromColor(end)
+        themefile = os.path.join(outputDir, name + '.json')
+        with open(themefile, 'w') as output:
+            json.dump(theme, output, indent=4)
+            output.write('\n')
+        themefiles.append(themefile)
+    return themefiles
+
 ############
 # Reset
 ############
@@ -904,6 +1605,1552 @@ def formatResetText() -> str:
 
     return '\\[\\033[0m\\]'
 
+############
+# Serve
+############
+def getServePromptStr(theme: list) -> tuple:
+    """Get the prompt string used with --serve, and the dynamic components
+
+    Parameters
+    ----------
+    theme : list
+        The validated theme components
+
+    Returns
+    -------
+    tuple
+        The prompt string and the list of dynamic components
+
+    Notes
+    -----
+    Dynamic component n is shown from ${pt_serve[n]}, which pt_serve_render
+    reads from the server each prompt. Parameter expansion results are not
+    expanded again, so rendered values need no escaping.
+    """
+
+    promptStr = ''
+    dynamic = []
+    for component in theme:
+        if component['type'].lower() in SERVE_TYPES:
+            promptStr += getConditionalStr('pt_serve[%d]' % (len(dynamic)), component, True)
+            dynamic.append(component)
+        else:
+            text = getComponentStr(component)
+            if text != None:
+                promptStr += text
+    return promptStr, dynamic
+
+def getServeVars(dynamic: list) -> list:
+    """Return the shell variables the dynamic components need per request
+
+    Parameters
+    ----------
+    dynamic : list
+        The dynamic components
+
+    Returns
+    -------
+    list
+        The variable names
+    """
+
+    names = []
+    for component in dynamic:
+        for name in SERVE_TYPES[component['type'].lower()]['vars']:
+            if name not in names:
+                names.append(name)
+    return names
+
+def renderServeRequest(dynamic: list, line: str) -> str:
+    """Render the dynamic components for one request
+
+    Parameters
+    ----------
+    dynamic : list
+        The dynamic components
+
+    line : str
+        The request: NAME=value fields separated by \\x1f
+
+    Returns
+    -------
+    str
+        The rendered values separated by \\x1f
+    """
+
+    request = {}
+    for field in line.rstrip('\n').split(SERVE_SEPARATOR):
+        name, _, value = field.partition('=')
+        request[name] = value
+
+    values = []
+    for component in dynamic:
+        try:
+            value = SERVE_TYPES[component['type'].lower()]['render'](component, request)
+        except Exception:
+            value = ''
+        values.append((value or '').replace(SERVE_SEPARATOR, ' ').replace('\n', ' '))
+    return SERVE_SEPARATOR.join(values)
+
+def serveTheme(theme: list):
+    """Answer render requests on stdin until it is closed
+
+    Parameters
+    ----------
+    theme : list
+        The validated theme components
+
+    Notes
+    -----
+    Run by pt_serve_start as a bash coproc. The first two lines written are
+    the prompt string and the variables each request must send. After that,
+    each request line gets one line of rendered values.
+    """
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    promptStr, dynamic = getServePromptStr(theme)
+    try:
+        sys.stdout.write(promptStr.replace('\n', '\\n') + '\n')
+        sys.stdout.write(' '.join(getServeVars(dynamic)) + '\n')
+        sys.stdout.flush()
+        for line in iter(sys.stdin.readline, ''):
+            sys.stdout.write(renderServeRequest(dynamic, line) + '\n')
+            sys.stdout.flush()
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+
+def renderCwd(component: dict, request: dict) -> str:
+    """Render the working directory, shortened like pt_bash_prompt_command
+
+    Parameters
+    ----------
+    component : dict
+        The cwd component (maxlen and trunc)
+
+    request : dict
+        The request variables (PWD and HOME)
+
+    Returns
+    -------
+    str
+        The shortened working directory
+    """
+
+    pwd = request.get('PWD', '')
+    home = request.get('HOME', '')
+    maxlen = max(int(component['maxlen']), len(pwd.rsplit('/', 1)[-1]))
+    newPwd = pwd
+    if home != '' and pwd.startswith(home):
+        newPwd = '~' + pwd[len(home):]
+    offset = len(newPwd) - maxlen
+    if offset > 0:
+        newPwd = newPwd[offset:offset + maxlen]
+        newPwd = component['trunc'] + '/' + newPwd.split('/', 1)[-1]
+    return newPwd
+
+############
+# Context
+############
+def getCachedFileValue(path: str, parser) -> str:
+    """Return a value parsed from a file, reparsing only when the file changes
+
+    Parameters
+    ----------
+    path : str
+        The file
+
+    parser : function
+        Called with the file contents, returns the value
+
+    Returns
+    -------
+    str
+        The value, or None if the file does not exist
+
+    Notes
+    -----
+    Costs one stat when the file is unchanged
+    """
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        CONTEXT_FILE_CACHE.pop(path, None)
+        return None
+    key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = CONTEXT_FILE_CACHE.get(path)
+    if cached != None and cached[0] == key:
+        return cached[1]
+    try:
+        with open(path, 'r', errors='replace') as contextFile:
+            value = parser(contextFile)
+    except OSError:
+        return None
+    CONTEXT_FILE_CACHE[path] = (key, value)
+    return value
+
+def parseKubeContext(lines) -> str:
+    """Return the current-context value from a kubeconfig file
+
+    Parameters
+    ----------
+    lines : iterable
+        The file lines
+
+    Returns
+    -------
+    str
+        The current context, or '' if not set
+    """
+
+    for line in lines:
+        if line.startswith('current-context:'):
+            return line[16:].split('#', 1)[0].strip().strip('"\'')
+    return ''
+
+def parseAwsRegions(lines) -> dict:
+    """Return the region of each profile in an AWS config file
+
+    Parameters
+    ----------
+    lines : iterable
+        The file lines
+
+    Returns
+    -------
+    dict
+        The profile name to region map
+    """
+
+    regions = {}
+    profile = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith('['):
+            profile = line.strip('[]').strip()
+            if profile.startswith('profile '):
+                profile = profile[8:].strip()
+        elif profile != None and line.startswith('region'):
+            key, _, value = line.partition('=')
+            if key.strip() == 'region':
+                regions[profile] = value.strip()
+    return regions
+
+def renderVirtualenv(component: dict, request: dict) -> str:
+    """Render the active Python virtual environment name
+
+    Parameters
+    ----------
+    component : dict
+        The virtualenv component
+
+    request : dict
+        The request variables (VIRTUAL_ENV and VIRTUAL_ENV_PROMPT)
+
+    Returns
+    -------
+    str
+        The environment name, or '' outside a virtual environment
+    """
+
+    venv = request.get('VIRTUAL_ENV', '')
+    if venv == '':
+        return ''
+    prompt = request.get('VIRTUAL_ENV_PROMPT', '').strip()
+    if prompt.startswith('(') and prompt.endswith(')'):
+        prompt = prompt[1:-1]
+    return prompt or os.path.basename(venv.rstrip('/'))
+
+def renderKube(component: dict, request: dict) -> str:
+    """Render the current kubernetes context without running kubectl
+
+    Parameters
+    ----------
+    component : dict
+        The kube component
+
+    request : dict
+        The request variables (KUBECONFIG and HOME)
+
+    Returns
+    -------
+    str
+        The current context, or '' if not set
+
+    Notes
+    -----
+    Like kubectl, the first file in KUBECONFIG that sets a context wins
+    """
+
+    paths = request.get('KUBECONFIG', '')
+    if paths == '':
+        paths = os.path.join(request.get('HOME', ''), '.kube', 'config')
+    for path in paths.split(':'):
+        if path == '':
+            continue
+        context = getCachedFileValue(path, parseKubeContext)
+        if context:
+            return context
+    return ''
+
+def renderAws(component: dict, request: dict) -> str:
+    """Render the active AWS profile, with its region if the component sets region
+
+    Parameters
+    ----------
+    component : dict
+        The aws component
+
+    request : dict
+        The request variables (AWS_PROFILE, AWS_CONFIG_FILE and HOME)
+
+    Returns
+    -------
+    str
+        The profile, or '' if no profile is selected
+    """
+
+    profile = request.get('AWS_PROFILE', '') or request.get('AWS_DEFAULT_PROFILE', '')
+    if profile == '':
+        return ''
+    if not component['region']:
+        return profile
+    region = request.get('AWS_REGION', '') or request.get('AWS_DEFAULT_REGION', '')
+    if region == '':
+        path = request.get('AWS_CONFIG_FILE', '')
+        if path == '':
+            path = os.path.join(request.get('HOME', ''), '.aws', 'config')
+        region = (getCachedFileValue(path, parseAwsRegions) or {}).get(profile, '')
+    if region == '':
+        return profile
+    return '%s (%s)' % (profile, region)
+
+############
+# Bundle
+############
+def getComponentFragments(theme: list) -> list:
+    """Get the compiled prompt fragment for each theme component
+
+    Parameters
+    ----------
+    theme : list
+        The validated theme components
+
+    Returns
+    -------
+    list
+        The prompt fragments, which join to the prompt string
+    """
+
+    fragments = []
+    for component in theme:
+        text = getComponentStr(component)
+        if text != None:
+            fragments.append(text)
+    return fragments
+
+def writeThemeBundle(themeDir: str, bundlePath: str):
+    """Compile every theme in a directory into a single indexed bundle file
+
+    Parameters
+    ----------
+    themeDir : str
+        The theme directory
+
+    bundlePath : str
+        The bundle file to write
+
+    Notes
+    -----
+    Layout (little endian):
+
+    - Header: magic, version, slot count
+    - Slots: open-addressed hash table of (name crc32, record offset)
+    - Records: name length, name, fragment count, then each fragment's
+      length and UTF-8 bytes
+
+    Sections are compiled at export time, so env values are those of the
+    exporting process. Themes that do not compile are skipped.
+    """
+
+    records = []
+    for name in sorted(getThemeNames(themeDir)):
+        try:
+            theme = validateTheme(loadThemeFile(os.path.join(themeDir, name + '.json')))
+            records.append((name, getComponentFragments(theme)))
+        except SystemExit:
+            print('ERROR: Skipping %s' % (name), file=sys.stderr)
+        except Exception as e:
+            print('ERROR: Skipping %s: %s' % (name, e), file=sys.stderr)
+
+    slotCount = max(1, 2 * len(records))
+    slots = [(0, 0)] * slotCount
+    body = bytearray()
+    bodyStart = BUNDLE_HEADER.size + slotCount * BUNDLE_SLOT.size
+    for name, fragments in records:
+        nameB = name.encode()
+        nameHash = zlib.crc32(nameB)
+        iS = nameHash % slotCount
+        while slots[iS][1] != 0:
+            iS = (iS + 1) % slotCount
+        slots[iS] = (nameHash, bodyStart + len(body))
+
+        body += struct.pack('<H', len(nameB)) + nameB
+        body += struct.pack('<H', len(fragments))
+        for fragment in fragments:
+            fragmentB = fragment.encode()
+            body += struct.pack('<I', len(fragmentB)) + fragmentB
+
+    data = bytearray(BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, slotCount))
+    for slot in slots:
+        data += BUNDLE_SLOT.pack(*slot)
+    data += body
+
+    tmpPath = '%s.tmp%d' % (bundlePath, os.getpid())
+    with open(tmpPath, 'wb') as bundleFile:
+        bundleFile.write(data)
+    os.replace(tmpPath, bundlePath)
+
+def openThemeBundle(bundlePath: str) -> mmap.mmap:
+    """Map a theme bundle file into memory
+
+    Parameters
+    ----------
+    bundlePath : str
+        The bundle file
+
+    Returns
+    -------
+    mmap.mmap
+        The read-only bundle mapping
+    """
+
+    if not os.path.isfile(bundlePath):
+        errorExit('Could not find theme bundle')
+    with open(bundlePath, 'rb') as bundleFile:
+        bundle = mmap.mmap(bundleFile.fileno(), 0, access=mmap.ACCESS_READ)
+    if (len(bundle) < BUNDLE_HEADER.size
+        or BUNDLE_HEADER.unpack_from(bundle, 0)[:2] != (BUNDLE_MAGIC, BUNDLE_VERSION)
+    ):
+        errorExit('Invalid theme bundle')
+    return bundle
+
+def getBundleFragments(bundle: mmap.mmap, name: str) -> list:
+    """Look up a theme's prompt fragments in a mapped bundle
+
+    Parameters
+    ----------
+    bundle : mmap.mmap
+        The bundle mapping
+
+    name : str
+        The theme name
+
+    Returns
+    -------
+    list
+        The prompt fragments, or None if the theme is not in the bundle
+
+    Notes
+    -----
+    Only the requested theme's record is read from the mapping
+    """
+
+    nameB = name.encode()
+    nameHash = zlib.crc32(nameB)
+    slotCount = BUNDLE_HEADER.unpack_from(bundle, 0)[2]
+    iS = nameHash % slotCount
+    for _ in range(slotCount):
+        slotHash, offset = BUNDLE_SLOT.unpack_from(bundle, BUNDLE_HEADER.size + iS * BUNDLE_SLOT.size)
+        if offset == 0:
+            return None
+        if slotHash == nameHash:
+            nameLen = struct.unpack_from('<H', bundle, offset)[0]
+            offset += 2
+            if bundle[offset:offset + nameLen] == nameB:
+                offset += nameLen
+                fragmentCount = struct.unpack_from('<H', bundle, offset)[0]
+                offset += 2
+                fragments = []
+                for _ in range(fragmentCount):
+                    fragmentLen = struct.unpack_from('<I', bundle, offset)[0]
+                    offset += 4
+                    fragments.append(bundle[offset:offset + fragmentLen].decode())
+                    offset += fragmentLen
+                return fragments
+        iS = (iS + 1) % slotCount
+    return None
+
+############
+# Profile
+############
+def getProfileMark(index: int) -> str:
+    """Return a prompt fragment that records the time it is expanded
+
+    Parameters
+    ----------
+    index : int
+        The mark index (0 before the first component, n after component n)
+
+    Returns
+    -------
+    str
+        The prompt fragment
+
+    Notes
+    -----
+    The mark is an arithmetic assignment in the subscript of an empty
+    array, so it expands to nothing and runs in the prompt's own shell
+    without forking. pt_prof_flush turns the marks into segment timings.
+    """
+
+    return '${pt_prof_nil[pt_prof_t[%d]=${EPOCHREALTIME//[!0-9]/}]}' % (index)
+
+def readProfileLog(logFile: str, last: int) -> dict:
+    """Read the last prompt timings from the profile logs
+
+    Parameters
+    ----------
+    logFile : str
+        A profile log written by pt_prof_flush, or a directory of them
+
+    last : int
+        The number of prompts to read from each log
+
+    Returns
+    -------
+    dict
+        The theme name to a dict with 'segments', the list of per-segment
+        timing lists, and 'hooks', the hook name to its timing list
+        (microseconds)
+
+    Notes
+    -----
+    Each shell writes its own <pid>.log, so shells never trim each
+    other's lines
+    """
+
+    if os.path.isdir(logFile):
+        logFiles = [os.path.join(logFile, f) for f in sorted(os.listdir(logFile)) if f.endswith('.log')]
+    elif os.path.isfile(logFile):
+        logFiles = [logFile]
+    else:
+        logFiles = []
+    if len(logFiles) == 0:
+        errorExit('Could not find profile log')
+    lines = []
+    for path in logFiles:
+        with open(path, 'r') as log:
+            lines += log.read().splitlines()[-last:]
+
+    timings = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        try:
+            deltas = [int(f) for f in fields[1:] if '=' not in f]
+            hookDeltas = [(f.split('=')[0], int(f.split('=')[1])) for f in fields[1:] if '=' in f]
+        except ValueError:
+            continue
+        themeTimings = timings.setdefault(fields[0], {'segments': [], 'hooks': {}})
+        segments = themeTimings['segments']
+        while len(segments) < len(deltas):
+            segments.append([])
+        for iS, delta in enumerate(deltas):
+            segments[iS].append(delta)
+        for hook, delta in hookDeltas:
+            themeTimings['hooks'].setdefault(hook, []).append(delta)
+    return timings
+
+def getProfileLabels(name: str) -> list:
+    """Return a label for each component of a shipped theme
+
+    Parameters
+    ----------
+    name : str
+        The theme name
+
+    Returns
+    -------
+    list
+        The component labels, or an empty list if the theme is not found
+    """
+
+    themefile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompt-themes', name + '.json')
+    if not os.path.isfile(themefile):
+        return []
+    labels = []
+    for component in validateTheme(loadThemeFile(themefile)):
+        text = component['text']
+        if component['type'].lower() != 'text':
+            text = component['type'].lower()
+        elif text == None:
+            text = ''
+        labels.append(text if len(text) <= 40 else text[:37] + '...')
+    return labels
+
+def printProfileReport(timings: dict):
+    """Print per-segment timing histograms
+
+    Parameters
+    ----------
+    timings : dict
+        The theme name to segment and hook timings, from readProfileLog
+    """
+
+    header = '%4s %6s %9s %9s %9s ' % ('seg', 'count', 'p50 ms', 'p90 ms', 'max ms')
+    header += ' '.join('%7s' % (b) for b in PROFILE_BUCKET_NAMES)
+    for name in sorted(timings):
+        labels = getProfileLabels(name)
+        print('%s' % (name))
+        print(header + '  text')
+        for iS, deltas in enumerate(timings[name]['segments']):
+            print(getProfileRow(str(iS), deltas, labels[iS] if iS < len(labels) else ''))
+        for hook in sorted(timings[name]['hooks']):
+            print(getProfileRow('hook', timings[name]['hooks'][hook], hook))
+        print()
+
+def getProfileRow(seg: str, deltas: list, label: str) -> str:
+    """Return one line of the profile report
+
+    Parameters
+    ----------
+    seg : str
+        The segment index, or 'hook' for a PROMPT_COMMAND hook
+
+    deltas : list
+        The timings (microseconds)
+
+    label : str
+        The segment text or hook name
+
+    Returns
+    -------
+    str
+        The report line
+    """
+
+    deltas = sorted(deltas)
+    buckets = [0] * len(PROFILE_BUCKET_NAMES)
+    for delta in deltas:
+        iB = 0
+        while iB < len(PROFILE_BUCKETS) and delta >= PROFILE_BUCKETS[iB]:
+            iB += 1
+        buckets[iB] += 1
+    line = '%4s %6d %9.3f %9.3f %9.3f ' % (
+        seg, len(deltas),
+        deltas[len(deltas) // 2] / 1000,
+        deltas[min(len(deltas) - 1, len(deltas) * 9 // 10)] / 1000,
+        deltas[-1] / 1000)
+    line += ' '.join('%7d' % (b) for b in buckets)
+    if label != '':
+        line += '  ' + label
+    return line
+
+############
+# Preview
+############
+def expandPrompts(promptStrs: list, errors: bool = False) -> list:
+    """Expand prompt strings the way bash would, using simulated values
+
+    Parameters
+    ----------
+    promptStrs : list
+        The compiled prompt strings
+
+    errors : bool
+        Return (prompt, stderr output) pairs instead of prompts
+
+    Returns
+    -------
+    list
+        The expanded prompts, containing raw ANSI escape sequences
+
+    Notes
+    -----
+    Prompts are expanded by one bash process per worker with ${PS1@P}, so
+    $(...) segments run against stubbed prompt functions. User and host
+    are substituted before expansion since bash does not take them from
+    the environment.
+    """
+
+    promptStrs = [simulatePromptEscapes(p) for p in promptStrs]
+    workers = min(len(promptStrs), os.cpu_count() or 1)
+    if workers == 0:
+        return []
+    chunkSize = -(-len(promptStrs) // workers)
+    chunks = [promptStrs[i:i + chunkSize] for i in range(0, len(promptStrs), chunkSize)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda chunk: expandPromptChunk(chunk, errors), chunks)
+    return [prompt for chunk in results for prompt in chunk]
+
+def simulatePromptEscapes(promptStr: str) -> str:
+    """Replace the user and host prompt escapes with simulated values
+
+    Parameters
+    ----------
+    promptStr : str
+        The compiled prompt string
+
+    Returns
+    -------
+    str
+        The prompt string with \\u, \\h and \\H replaced
+    """
+
+    values = {
+        'u': PREVIEW_VALUES['user'],
+        'h': PREVIEW_VALUES['host'].split('.')[0],
+        'H': PREVIEW_VALUES['host']
+    }
+    return re.sub(r'\\(.)', lambda m: values.get(m.group(1), m.group(0)), promptStr)
+
+def expandPromptChunk(promptStrs: list, errors: bool) -> list:
+    """Expand a list of prompt strings in a single bash process
+
+    Parameters
+    ----------
+    promptStrs : list
+        The prompt strings with user and host already substituted
+
+    errors : bool
+        Return (prompt, stderr output) pairs instead of prompts
+
+    Returns
+    -------
+    list
+        The expanded prompts
+    """
+
+    env = dict(os.environ)
+    for key, value in PREVIEW_VALUES.items():
+        env['pt_sim_' + key] = value
+    env['pt_app_dir'] = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmpDir:
+        if errors:
+            env['pt_sim_errors'] = os.path.join(tmpDir, 'stderr')
+        result = subprocess.run(
+            ['bash', '--norc', '--noprofile', '-c', PREVIEW_BASH],
+            input=''.join(p + '\0' for p in promptStrs).encode(),
+            stdout=subprocess.PIPE,
+            env=env
+        )
+    prompts = result.stdout.decode(errors='replace').split('\0')[:-1]
+    if errors:
+        prompts = list(zip(prompts[0::2], prompts[1::2]))
+    if len(prompts) != len(promptStrs):
+        errorExit('Could not expand prompts for preview')
+    return prompts
+
+def getPreviewAnsi(prompt: str) -> str:
+    """Return an expanded prompt as ANSI text suitable for cat
+
+    Parameters
+    ----------
+    prompt : str
+        The expanded prompt
+
+    Returns
+    -------
+    str
+        The prompt without readline markers, followed by a reset
+    """
+
+    prompt = re.sub(r'\x1b\][^\x07]*\x07', '', prompt)
+    return prompt.replace('\x01', '').replace('\x02', '') + '\x1b[0m'
+
+def getPreviewHtml(prompt: str) -> str:
+    """Return an expanded prompt as HTML spans
+
+    Parameters
+    ----------
+    prompt : str
+        The expanded prompt
+
+    Returns
+    -------
+    str
+        The prompt as HTML, with colors from the 8-bit palette
+    """
+
+    prompt = getPreviewAnsi(prompt)
+    state = {}
+    parts = []
+    pos = 0
+    for match in re.finditer(r'\x1b\[([0-9;]*)m', prompt):
+        if match.start() > pos:
+            parts.append(getPreviewSpan(state, prompt[pos:match.start()]))
+        applySgr(state, match.group(1))
+        pos = match.end()
+    if pos < len(prompt):
+        parts.append(getPreviewSpan(state, prompt[pos:]))
+    return ''.join(parts)
+
+def applySgr(state: dict, params: str):
+    """Apply an SGR escape sequence to the preview format state
+
+    Parameters
+    ----------
+    state : dict
+        The current format state (fg, bg and effects)
+
+    params : str
+        The semicolon separated SGR parameters
+    """
+
+    codes = [int(c) if c.isdigit() else 0 for c in params.split(';')]
+    iC = 0
+    while iC < len(codes):
+        code = codes[iC]
+        if code == 0:
+            state.clear()
+        elif code in PREVIEW_EFFECTS:
+            state[PREVIEW_EFFECTS[code]] = True
+        elif code in (38, 48) and iC + 2 < len(codes) and codes[iC + 1] == 5:
+            state['fg' if code == 38 else 'bg'] = COLOR_8BIT_D['idMap'].get(codes[iC + 2])
+            iC += 2
+        elif code == 39 or code == 49:
+            state.pop('fg' if code == 39 else 'bg', None)
+        elif 30 <= code <= 37 or 90 <= code <= 97:
+            state['fg'] = COLOR_8BIT_D['idMap'][code - 30 if code < 90 else code - 82]
+        elif 40 <= code <= 47 or 100 <= code <= 107:
+            state['bg'] = COLOR_8BIT_D['idMap'][code - 40 if code < 100 else code - 92]
+        iC += 1
+
+def getPreviewSpan(state: dict, text: str) -> str:
+    """Return text wrapped in a span styled by the preview format state
+
+    Parameters
+    ----------
+    state : dict
+        The current format state
+
+    text : str
+        The text to style
+
+    Returns
+    -------
+    str
+        The HTML span
+    """
+
+    fg = state.get('fg')
+    bg = state.get('bg')
+    if state.get('invert'):
+        fg, bg = (bg or PREVIEW_DEFAULT_BG), (fg or PREVIEW_DEFAULT_FG)
+    styles = []
+    if fg != None:
+        styles.append('color:#%02x%02x%02x' % fg)
+    if bg != None:
+        styles.append('background:#%02x%02x%02x' % bg)
+    if state.get('bold'):
+        styles.append('font-weight:bold')
+    if state.get('dim'):
+        styles.append('opacity:0.6')
+    if state.get('underline'):
+        styles.append('text-decoration:underline')
+    if state.get('hidden'):
+        styles.append('visibility:hidden')
+    text = html.escape(text)
+    if len(styles) == 0:
+        return text
+    return '<span style="%s">%s</span>' % (';'.join(styles), text)
+
+def getPreviewGallery(names: list, prompts: list, previewFormat: str) -> str:
+    """Return a gallery of expanded prompts
+
+    Parameters
+    ----------
+    names : list
+        The theme names
+
+    prompts : list
+        The expanded prompts, in the same order as the names
+
+    previewFormat : str
+        ansi or html
+
+    Returns
+    -------
+    str
+        The gallery document
+    """
+
+    if previewFormat == 'ansi':
+        return ''.join('%s\n%s\n\n' % (n, getPreviewAnsi(p)) for n, p in zip(names, prompts))
+
+    entries = []
+    for name, prompt in zip(names, prompts):
+        entries.append('<div class="theme"><div class="name">%s</div><pre>%s</pre></div>'
+            % (html.escape(name), getPreviewHtml(prompt)))
+    return PREVIEW_HTML % ('\n'.join(entries))
+
+def previewThemes(themefiles: list, previewFormat: str, outputFile: str):
+    """Render previews of theme files and write them out
+
+    Parameters
+    ----------
+    themefiles : list
+        The theme files
+
+    previewFormat : str
+        ansi or html
+
+    outputFile : str
+        The file to write, or None for stdout
+    """
+
+    names = []
+    promptStrs = []
+    for themefile in themefiles:
+        promptStr = compileThemeFile(themefile)
+        if promptStr == None:
+            print('ERROR: Skipping %s' % (themefile), file=sys.stderr)
+            continue
+        names.append(os.path.basename(themefile)[:-5])
+        promptStrs.append(promptStr)
+
+    if len(themefiles) == 1 and len(names) == 1:
+        prompt = expandPrompts(promptStrs)[0]
+        if previewFormat == 'ansi':
+            text = getPreviewAnsi(prompt) + '\n'
+        else:
+            text = getPreviewHtml(prompt) + '\n'
+    else:
+        text = getPreviewGallery(names, expandPrompts(promptStrs), previewFormat)
+
+    if outputFile == None:
+        sys.stdout.write(text)
+    else:
+        with open(outputFile, 'w') as output:
+            output.write(text)
+
+############
+# Verify
+############
+def checkGolden(themeDir: str, goldenDir: str, write: bool, fuzzCount: int, seed: int) -> bool:
+    """Compare compiled prompts with the golden corpus
+
+    Parameters
+    ----------
+    themeDir : str
+        The theme directory
+
+    goldenDir : str
+        The golden corpus directory, one <theme>.ps1 per theme and fuzz.jsonl
+
+    write : bool
+        Write the corpus from the current output instead of comparing
+
+    fuzzCount : int
+        The number of random themes written to fuzz.jsonl
+
+    seed : int
+        The random seed of the themes written to fuzz.jsonl
+
+    Returns
+    -------
+    bool
+        True if every theme matches
+
+    Notes
+    -----
+    fuzz.jsonl holds random themes with the prompt (or error) the compiler
+    gave when the corpus was written, so changes to getPromptStr, formatColor
+    or the color tables show up outside the shipped themes too.
+    """
+
+    if write:
+        os.makedirs(goldenDir, exist_ok=True)
+    ok = True
+    for name in sorted(getThemeNames(themeDir)):
+        promptStr = compileThemeFile(os.path.join(themeDir, name + '.json'))
+        if promptStr == None:
+            print('ERROR %s does not compile, skipping' % (name))
+            ok = False
+            continue
+        goldenFile = os.path.join(goldenDir, name + '.ps1')
+        if write:
+            with open(goldenFile, 'w') as golden:
+                golden.write(promptStr + '\n')
+            continue
+        if not os.path.isfile(goldenFile):
+            print('MISSING %s' % (name))
+            ok = False
+            continue
+        with open(goldenFile, 'r') as golden:
+            expected = golden.read()[:-1]
+        if promptStr != expected:
+            print('CHANGED %s' % (name))
+            ok = False
+
+    if not write and not checkPromptQuoting():
+        ok = False
+
+    fuzzFile = os.path.join(goldenDir, 'fuzz.jsonl')
+    if write:
+        with open(fuzzFile, 'w') as golden:
+            for theme, promptStr, error in getFuzzThemes(fuzzCount, seed):
+                record = {"theme": theme}
+                if error != None:
+                    record['error'] = error
+                else:
+                    record['ps1'] = promptStr
+                golden.write(json.dumps(record) + '\n')
+        return ok
+    if not os.path.isfile(fuzzFile):
+        print('MISSING fuzz.jsonl')
+        return False
+    with open(fuzzFile, 'r') as golden:
+        records = [json.loads(line) for line in golden]
+    lines = []
+    promptStrs = []
+    for iL, record in enumerate(records):
+        promptStr, error = getFuzzPromptStr(record['theme'])
+        if promptStr != record.get('ps1') or error != record.get('error'):
+            print('CHANGED fuzz.jsonl line %d: %s' % (iL + 1, json.dumps(record['theme'])))
+            ok = False
+        if promptStr != None:
+            lines.append(iL)
+            promptStrs.append(promptStr)
+    for iP, reason in checkPromptExpansion(promptStrs):
+        print('EXPAND fuzz.jsonl line %d: %s' % (lines[iP] + 1, reason))
+        ok = False
+    return ok
+
+def checkPromptQuoting() -> bool:
+    """Check that conditional sections render their text like text sections
+
+    Returns
+    -------
+    bool
+        True if every text renders the same
+
+    Notes
+    -----
+    Each text in QUOTING_TEXTS is compiled as a text section and as a git
+    section that is shown, and both are expanded by bash.
+    """
+
+    promptStrs = []
+    for text in QUOTING_TEXTS:
+        promptStrs.append(getPromptStr(validateTheme([{"text": text}])))
+        promptStrs.append(getPromptStr(validateTheme([{"type": "git", "field": "inside", "text": text}])))
+    prompts = expandPrompts(promptStrs)
+    ok = True
+    for iT, text in enumerate(QUOTING_TEXTS):
+        if prompts[2 * iT] != prompts[2 * iT + 1]:
+            print('QUOTING %s: %s renders as %s' % (json.dumps(text), json.dumps(prompts[2 * iT]),
+                json.dumps(prompts[2 * iT + 1])))
+            ok = False
+    return ok
+
+def checkPromptExpansion(promptStrs: list) -> list:
+    """Expand compiled prompts with bash and return the ones that fail
+
+    Parameters
+    ----------
+    promptStrs : list
+        The compiled prompt strings
+
+    Returns
+    -------
+    list
+        (index, reason) for each prompt bash printed errors for or left
+        unexpanded
+    """
+
+    failures = []
+    for iP, (prompt, error) in enumerate(expandPrompts(promptStrs, True)):
+        if error != '':
+            failures.append((iP, 'bash error %s' % (json.dumps(error))))
+        elif '${pt_' in prompt or '$(pt_' in prompt:
+            failures.append((iP, 'unexpanded %s' % (json.dumps(prompt))))
+    return failures
+
+def getFuzzPromptStr(theme: list) -> tuple:
+    """Compile a random theme, catching errors
+
+    Parameters
+    ----------
+    theme : list
+        The theme components
+
+    Returns
+    -------
+    tuple
+        The prompt string and None, or None and the error
+    """
+
+    # env sections compile to the variable's value, so use one that is the
+    # same on every machine
+    os.environ[FUZZ_ENV] = FUZZ_ENV_VALUE
+    try:
+        return getPromptStr(validateTheme(theme)), None
+    except Exception as e:
+        return None, '%s: %s' % (type(e).__name__, e)
+
+def getFuzzThemes(count: int, seed: int) -> list:
+    """Return random themes with their compiled prompts
+
+    Parameters
+    ----------
+    count : int
+        The number of themes
+
+    seed : int
+        The random seed
+
+    Returns
+    -------
+    list
+        (theme, prompt string, error) for each theme
+    """
+
+    rng = random.Random(seed)
+    themes = []
+    for _ in range(count):
+        theme = getFuzzTheme(rng)
+        themes.append((theme,) + getFuzzPromptStr(theme))
+    return themes
+
+def getFuzzColor(rng: random.Random, depth: int) -> str:
+    """Return a random color in any of the formats a theme accepts
+
+    Parameters
+    ----------
+    rng : random.Random
+        The random generator
+
+    depth : int
+        The color bit depth
+
+    Returns
+    -------
+    str
+        The color
+    """
+
+    kind = rng.randrange(5 if depth == 8 else 3)
+    if kind == 0:
+        return 'default'
+    elif kind == 1:
+        nameMap = COLOR_8BIT_D['nameMap'] if depth == 8 else COLOR_4BIT_D['nameMap']
+        name = rng.choice(sorted(nameMap))
+        return name.upper() if rng.random() < 0.2 else name
+    elif kind == 2:
+        return str(rng.randrange(256) if depth == 8 else rng.choice(list(range(8)) + list(range(60, 68))))
+    elif kind == 3:
+        return '#%02x%02x%02x' % (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    return 'rgb(%d,%d,%d)' % (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+
+def getFuzzTheme(rng: random.Random) -> list:
+    """Return a random valid theme
+
+    Parameters
+    ----------
+    rng : random.Random
+        The random generator
+
+    Returns
+    -------
+    list
+        The theme components
+    """
+
+    theme = []
+    for _ in range(rng.randrange(1, 12)):
+        component = {}
+        kind = rng.choice(['text', 'text', 'text', 'reset', 'env', 'git', 'cwd'] + CONTEXT_TYPES)
+        if kind != 'text' or rng.random() < 0.5:
+            component['type'] = kind
+        if kind == 'env':
+            component['env'] = FUZZ_ENV
+        elif kind == 'git':
+            component['field'] = rng.choice(sorted(GIT_FIELDS))
+        elif kind == 'cwd':
+            component['maxlen'] = rng.randrange(5, 60)
+            component['trunc'] = rng.choice(['..', '', "'"])
+        elif kind == 'aws':
+            component['region'] = rng.random() < 0.5
+        if kind != 'env' or rng.random() < 0.5:
+            text = ''.join(rng.choice(FUZZ_TEXT) for _ in range(rng.randrange(6)))
+            # A theme with "${" in its text, or across two sections, is invalid
+            # shell rather than a compiler bug
+            text = text.replace('${', '$ {')
+            component['text'] = text + ' ' if text[-1:] == '$' else text
+        if rng.random() < 0.7:
+            depth = rng.choice([4, 8])
+            color = {}
+            if rng.random() < 0.7:
+                color['depth'] = depth
+            else:
+                depth = 4
+            for key in ('fg', 'bg'):
+                if rng.random() < 0.7:
+                    color[key] = getFuzzColor(rng, depth)
+            if rng.random() < 0.5:
+                color['effect'] = rng.choice(['none', 'bold', 'DIM', 'underline', 'blink', 'invert', 'hidden'])
+            component['color'] = color
+        theme.append(component)
+    return theme
+
+def fuzzCompiler(count: int, seed: int) -> bool:
+    """Compile random themes and diff the fast paths against the reference
+
+    Parameters
+    ----------
+    count : int
+        The number of random themes
+
+    seed : int
+        The random seed
+
+    Returns
+    -------
+    bool
+        True if no differences were found
+
+    Notes
+    -----
+    getPromptStr is compared with the bundle (precompiled fragments loaded
+    through mmap), the serve prompt string for themes without dynamic
+    sections, and the batch color conversion for every rgb and hex color.
+    Those paths share getComponentStr and the color tables with
+    getPromptStr, so regressions in the shared code are caught by the
+    frozen fuzz.jsonl in the golden corpus instead (see checkGolden).
+
+    Themes the reference fails to compile are printed with their error.
+    """
+
+    themes = []
+    crashes = []
+    for theme, promptStr, error in getFuzzThemes(count, seed):
+        if error != None:
+            crashes.append((theme, error))
+        else:
+            themes.append(theme)
+
+    failures = []
+    start = time.perf_counter()
+    promptStrs = [getPromptStr(validateTheme(theme)) for theme in themes]
+    compileTime = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for iT, theme in enumerate(themes):
+            with open(os.path.join(tmpDir, 'fuzz-%d.json' % (iT)), 'w') as themeFile:
+                json.dump(theme, themeFile)
+        bundlePath = os.path.join(tmpDir, 'fuzz.ptb')
+        writeThemeBundle(tmpDir, bundlePath)
+        bundle = openThemeBundle(bundlePath)
+        start = time.perf_counter()
+        bundleStrs = [''.join(getBundleFragments(bundle, 'fuzz-%d' % (iT))) for iT in range(len(themes))]
+        bundleTime = time.perf_counter() - start
+        bundle.close()
+
+    rgbs = []
+    references = []
+    for iT, theme in enumerate(themes):
+        if bundleStrs[iT] != promptStrs[iT]:
+            failures.append('bundle differs for theme %d: %s' % (iT, json.dumps(theme)))
+        nTheme = validateTheme(theme)
+        if not any(c['type'].lower() in SERVE_TYPES for c in nTheme):
+            if getServePromptStr(nTheme)[0] != promptStrs[iT]:
+                failures.append('serve differs for theme %d: %s' % (iT, json.dumps(theme)))
+        for component in nTheme:
+            color = component['color']
+            if color == None or color['depth'] != 8:
+                continue
+            for key in ('fg', 'bg'):
+                value = color[key]
+                if value == None or (value[:1] != '#' and value[:3].lower() != 'rgb'):
+                    continue
+                try:
+                    references.append(int(getColorCode(value, 'FG', 8).split(';')[-1]))
+                except KeyError:
+                    # Reset sections compile without their color
+                    continue
+                rgbs.append(getRgbFromColor(value))
+
+    codes = getColorCodesFromRgb(rgbs, 8)
+    if numpy != None and len(rgbs) > 0:
+        arrayCodes = getColorCodesFromRgb(numpy.asarray(rgbs, dtype=numpy.uint8), 8).tolist()
+    else:
+        arrayCodes = codes
+    for iC, rgb in enumerate(rgbs):
+        if codes[iC] != references[iC] or arrayCodes[iC] != references[iC]:
+            failures.append('color conversion differs for rgb%s: %s (reference %s)'
+                % (rgb, codes[iC], references[iC]))
+
+    for iT, reason in checkPromptExpansion(promptStrs):
+        failures.append('%s for theme %d: %s' % (reason, iT, json.dumps(themes[iT])))
+
+    for theme, error in crashes[:20]:
+        print('CRASH %s: %s' % (error, json.dumps(theme)))
+    for failure in failures[:20]:
+        print('FAIL %s' % (failure))
+    print('seed %d: %d themes, %d colors, %d failures' % (seed, len(themes), len(rgbs), len(failures)))
+    print('%d of %d themes crash the reference compiler' % (len(crashes), count))
+    print('reference compile: %.0f themes/s' % (len(themes) / compileTime))
+    print('bundle lookup: %.0f themes/s' % (len(themes) / bundleTime))
+    return len(failures) == 0
+
+############
+# Watch
+############
+def getCacheDir() -> str:
+    """Return the directory compiled prompts are published to
+
+    Returns
+    -------
+    str
+        The cache directory, from PT_CACHE_DIR or XDG_CACHE_HOME
+    """
+
+    if os.environ.get('PT_CACHE_DIR'):
+        return os.environ['PT_CACHE_DIR']
+    cacheHome = os.environ.get('XDG_CACHE_HOME')
+    if not cacheHome:
+        cacheHome = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cacheHome, 'prompt-theme')
+
+def compileThemeFile(themefile: str) -> str:
+    """Compile a theme file to a prompt string without exiting on errors
+
+    Parameters
+    ----------
+    themefile : str
+        The path to the theme file
+
+    Returns
+    -------
+    str
+        The prompt string, or None if the theme could not be compiled
+    """
+
+    try:
+        return getPromptStr(validateTheme(loadThemeFile(themefile)))
+    except SystemExit:
+        return None
+    except Exception as e:
+        print('ERROR compiling %s: %s' % (themefile, e), file=sys.stderr)
+        return None
+
+def publishPrompt(cacheDir: str, name: str, promptStr: str):
+    """Publish a compiled prompt to the cache and bump its generation stamp
+
+    Parameters
+    ----------
+    cacheDir : str
+        The cache directory
+
+    name : str
+        The theme name
+
+    promptStr : str
+        The compiled prompt
+
+    Notes
+    -----
+    Shells running pt_theme_reload only stat the <name>.<generation> marker
+    of the generation they loaded. Removing it is what signals a reload, so
+    it is removed last, after the prompt and generation files are in place.
+    """
+
+    base = os.path.join(cacheDir, name)
+    gen = 0
+    try:
+        with open(base + '.gen', 'r') as genFile:
+            gen = int(genFile.read().strip() or 0)
+    except (OSError, ValueError):
+        gen = 0
+
+    writeFileAtomic(base + '.ps1', promptStr + '\n')
+    writeFileAtomic(base + '.gen', '%d\n' % (gen + 1))
+    writeFileAtomic('%s.%d' % (base, gen + 1), '')
+    try:
+        os.remove('%s.%d' % (base, gen))
+    except OSError:
+        pass
+
+def writeFileAtomic(path: str, text: str):
+    """Write a file so readers never see a partial write
+
+    Parameters
+    ----------
+    path : str
+        The file to write
+
+    text : str
+        The file contents
+    """
+
+    tmpPath = '%s.tmp%d' % (path, os.getpid())
+    with open(tmpPath, 'w') as tmpFile:
+        tmpFile.write(text)
+    os.replace(tmpPath, path)
+
+def compileThemes(themeDir: str, cacheDir: str, names: set):
+    """Compile the given themes and publish them to the cache
+
+    Parameters
+    ----------
+    themeDir : str
+        The theme directory
+
+    cacheDir : str
+        The cache directory
+
+    names : set
+        The theme names (file names without the .json extension)
+    """
+
+    for name in sorted(names):
+        themefile = os.path.join(themeDir, name + '.json')
+        if not os.path.isfile(themefile):
+            continue
+        promptStr = compileThemeFile(themefile)
+        if promptStr == None or promptStr == '':
+            print('ERROR: Skipping %s' % (name), file=sys.stderr)
+            continue
+        publishPrompt(cacheDir, name, promptStr)
+
+def getThemeNames(themeDir: str) -> set:
+    """Return the names of the themes in a theme directory
+
+    Parameters
+    ----------
+    themeDir : str
+        The theme directory
+
+    Returns
+    -------
+    set
+        The theme names
+    """
+
+    return set(f[:-5] for f in os.listdir(themeDir) if f.endswith('.json'))
+
+def watchThemes(themeDir: str, cacheDir: str):
+    """Compile every theme, then recompile themes as their files change
+
+    Parameters
+    ----------
+    themeDir : str
+        The theme directory
+
+    cacheDir : str
+        The cache directory
+
+    Notes
+    -----
+    Uses inotify where available and falls back to polling file mtimes.
+    Runs until interrupted.
+    """
+
+    os.makedirs(cacheDir, exist_ok=True)
+    compileThemes(themeDir, cacheDir, getThemeNames(themeDir))
+
+    try:
+        watcher = openInotify(themeDir)
+    except OSError:
+        watcher = None
+
+    try:
+        if watcher != None:
+            while True:
+                compileThemes(themeDir, cacheDir, readInotifyNames(watcher))
+        else:
+            mtimes = getThemeMtimes(themeDir)
+            while True:
+                time.sleep(WATCH_POLL_SECONDS)
+                nMtimes = getThemeMtimes(themeDir)
+                changed = set(n for n in nMtimes if mtimes.get(n) != nMtimes[n])
+                mtimes = nMtimes
+                compileThemes(themeDir, cacheDir, changed)
+    except KeyboardInterrupt:
+        pass
+
+def getThemeMtimes(themeDir: str) -> dict:
+    """Return the modification time of every theme in a theme directory
+
+    Parameters
+    ----------
+    themeDir : str
+        The theme directory
+
+    Returns
+    -------
+    dict
+        The theme name to mtime map
+    """
+
+    mtimes = {}
+    for name in getThemeNames(themeDir):
+        try:
+            mtimes[name] = os.stat(os.path.join(themeDir, name + '.json')).st_mtime_ns
+        except OSError:
+            pass
+    return mtimes
+
+def openInotify(themeDir: str) -> int:
+    """Open an inotify file descriptor watching the theme directory
+
+    Parameters
+    ----------
+    themeDir : str
+        The theme directory
+
+    Returns
+    -------
+    int
+        The inotify file descriptor
+
+    Notes
+    -----
+    Raises OSError when inotify is not available on this system
+    """
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init()
+    except (AttributeError, TypeError):
+        raise OSError('inotify not available')
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), 'inotify_init failed')
+    mask = INOTIFY_CLOSE_WRITE | INOTIFY_MOVED_TO
+    if libc.inotify_add_watch(fd, os.fsencode(themeDir), mask) < 0:
+        os.close(fd)
+        raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+    return fd
+
+def readInotifyNames(fd: int) -> set:
+    """Block until theme files change and return the changed theme names
+
+    Parameters
+    ----------
+    fd : int
+        The inotify file descriptor
+
+    Returns
+    -------
+    set
+        The changed theme names
+    """
+
+    names = set()
+    data = os.read(fd, 64 * 1024)
+    offset = 0
+    while offset + INOTIFY_EVENT_SIZE <= len(data):
+        _, _, _, nameLen = struct.unpack_from('iIII', data, offset)
+        offset += INOTIFY_EVENT_SIZE
+        name = data[offset:offset + nameLen].rstrip(b'\0').decode(errors='replace')
+        offset += nameLen
+        if name.endswith('.json'):
+            names.add(name[:-5])
+    return names
+
 ############
 # System
 ############
@@ -924,6 +3171,126 @@ def printPrompt(promptStr: str):
 DEFAULT_COLOR = -1
 COLOR_4BIT_D = getColor4BitLookupDict()
 COLOR_8BIT_D = getColor8BitLookupDict()
+COLOR_CONVERSION_T = None
+PALETTE_SEGMENTS = [
+    [{"text": "\uF2C0 \\u"}],
+    [{"text": "\uF878 \\h"}],
+    [
+        {"type": "git", "field": "inside", "text": "\uE725 "},
+        {"type": "git", "field": "branch"},
+        {"type": "git", "field": "clean", "text": " \uF00C"},
+        {"type": "git", "field": "dirty", "text": " \uFB4E"}
+    ],
+    [{"type": "cwd", "maxlen": 40, "trunc": "\uF6D7", "text": "\uE613 "}]
+]
+WATCH_POLL_SECONDS = 1
+INOTIFY_CLOSE_WRITE = 0x00000008
+INOTIFY_MOVED_TO = 0x00000080
+INOTIFY_EVENT_SIZE = struct.calcsize('iIII')
+BUNDLE_MAGIC = b'PTB1'
+BUNDLE_VERSION = 1
+BUNDLE_HEADER = struct.Struct('<4sHI')
+BUNDLE_SLOT = struct.Struct('<II')
+PREVIEW_VALUES = {
+    'user': 'user',
+    'host': 'host',
+    'home': '/home/user',
+    'pwd': '/home/user/projects/prompt-theme',
+    'git': '1',
+    'branch': 'main',
+    'clean': '0',
+    'ahead': '1',
+    'unstaged': '2',
+    'virtualenv': 'venv',
+    'kube': 'minikube',
+    'aws': 'default',
+    'aws_region': 'us-east-1',
+    'status': '0'
+}
+PREVIEW_BASH = '''
+. "$pt_app_dir/prompt-functions.env"
+pt_get_git_dir(){ echo "$pt_sim_git"; }
+pt_get_git_branch(){ echo "$pt_sim_branch"; }
+pt_get_git_clean(){ [ "$pt_sim_clean" = 1 ] && echo "${1:-clean}" || echo "${2:-changed}"; }
+pt_sim_status(){ return $1; }
+pt_git_inside=$pt_sim_git
+pt_git_branch=$pt_sim_branch
+pt_git_ahead=$pt_sim_ahead
+pt_git_unstaged=$pt_sim_unstaged
+[ "$pt_sim_clean" = 1 ] && pt_git_clean=1 || pt_git_dirty=1
+pt_ctx_virtualenv=$pt_sim_virtualenv
+pt_ctx_kube=$pt_sim_kube
+pt_ctx_aws=$pt_sim_aws
+pt_ctx_aws_region="$pt_sim_aws ($pt_sim_aws_region)"
+HOME=$pt_sim_home
+PWD=$pt_sim_pwd
+while IFS= read -r -d '' PS1; do
+    if [ -n "$pt_sim_errors" ]; then
+        # Some expansion errors exit the shell, so expand in a subshell
+        prompt=$(pt_sim_status "$pt_sim_status"; { printf '%s.' "${PS1@P}"; } 2> "$pt_sim_errors")
+        printf '%s\\0%s\\0' "${prompt%.}" "$(< "$pt_sim_errors")"
+    else
+        pt_sim_status "$pt_sim_status"
+        printf '%s\\0' "${PS1@P}"
+    fi
+done
+'''
+PROMPT_ESCAPES = 'aAdDehHjlnrstTuvVwW!#$@[]01234567'
+PROMPT_QUOTED = {'$': '\\\\$', '`': '\\`', '"': '\\"', '\\': '\\\\\\\\'}
+GIT_FIELDS = {
+    'inside': False,
+    'branch': True,
+    'oid': True,
+    'upstream': True,
+    'ahead': True,
+    'behind': True,
+    'staged': True,
+    'unstaged': True,
+    'untracked': True,
+    'conflicts': True,
+    'stash': True,
+    'clean': False,
+    'dirty': False
+}
+SERVE_SEPARATOR = '\x1f'
+SERVE_TYPES = {
+    'cwd': {'render': renderCwd, 'vars': ['PWD', 'HOME']},
+    'virtualenv': {'render': renderVirtualenv, 'vars': ['VIRTUAL_ENV', 'VIRTUAL_ENV_PROMPT']},
+    'kube': {'render': renderKube, 'vars': ['KUBECONFIG', 'HOME']},
+    'aws': {'render': renderAws, 'vars': ['AWS_PROFILE', 'AWS_DEFAULT_PROFILE', 'AWS_REGION',
+        'AWS_DEFAULT_REGION', 'AWS_CONFIG_FILE', 'HOME']}
+}
+CONTEXT_TYPES = ['virtualenv', 'kube', 'aws']
+CONTEXT_FILE_CACHE = {}
+FUZZ_GOLDEN_COUNT = 500
+FUZZ_ENV = 'PT_FUZZ_ENV'
+FUZZ_ENV_VALUE = '/home/fuzz'
+QUOTING_TEXTS = ["it's ", 'k8s "x"', '}', '{}', '\\', 'a\\', '\\\\', 'a\\"b', '\\\\"', '\\}', "\\'",
+    '`', '$', '\\$ ', '\\\\$', '$HOME', '$(echo hi)', '\\u@\\h', '\\[\\]', '"\uE0B0"']
+FUZZ_TEXT = ['a', 'Z', ' ', '\\u', '\\h', '\\w', '$', '}', '{', "'", '"', '\uE0B0', '\uF2C0', '$(pt_bash_prompt_command)']
+PROFILE_BUCKETS = [100, 1000, 10000, 100000]
+PROFILE_BUCKET_NAMES = ['<0.1ms', '<1ms', '<10ms', '<100ms', '>=100ms']
+PREVIEW_EFFECTS = {1: 'bold', 2: 'dim', 4: 'underline', 5: 'blink', 7: 'invert', 8: 'hidden'}
+PREVIEW_DEFAULT_FG = (192, 192, 192)
+PREVIEW_DEFAULT_BG = (0, 0, 0)
+PREVIEW_HTML = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Prompt-Theme Gallery</title>
+<style>
+body { background: #202020; color: #c0c0c0; font-family: sans-serif; }
+.theme { margin: 1em; }
+.name { margin-bottom: 0.25em; }
+pre { background: #000000; color: #c0c0c0; padding: 0.5em; margin: 0;
+      font-family: "Hack Nerd Font", "DejaVuSansMono Nerd Font", monospace; }
+</style>
+</head>
+<body>
+%s
+</body>
+</html>
+'''
 
 if __name__ == "__main__":
    main(sys.argv[1:])